@@ -1,15 +1,39 @@
 ﻿import argparse
-import json
+import asyncio
 import sqlite3
 from dataclasses import dataclass
 from datetime import datetime, timezone
+from functools import partial
 from pathlib import Path
-from typing import Iterable, List, Optional
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
 
+import aiohttp
+import orjson
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from lxml import etree, html as lxml_html
+from selectolax.lexbor import LexborHTMLParser, LexborNode
 
 FEED_URL = "https://habr.com/ru/feed/"
+FETCH_CONCURRENCY = 8
+# 100 rows x 8 columns stays under SQLite's default 999 bound-parameter limit.
+INSERT_CHUNK_ROWS = 100
+
+# Article body candidates, best first. Each query below collects all of them in one
+# pass and body_priority picks the winner, since document order puts the outer
+# article container before the nested #post-content-body.
+BODY_SELECTOR = "#post-content-body, div.article-body, article.tm-article-presenter__content"
+# Text inside these tags is code, not article text (BS4's get_text skips it too).
+NON_TEXT_TAGS = frozenset({"script", "style", "template"})
+TAG_LIST_SELECTOR = "div.tm-separated-list.tag-list a.link span"
+TAGS_SELECTOR = f"{TAG_LIST_SELECTOR}, a.tm-tags-list__link span"
+# Compiled once and reused for every article that falls back to lxml.
+_BODY_XPATH = etree.XPath(
+    "//*[@id='post-content-body']"
+    " | //div[contains(concat(' ', normalize-space(@class), ' '), ' article-body ')]"
+    " | //article[contains(concat(' ', normalize-space(@class), ' '), ' tm-article-presenter__content ')]"
+)
+_UTF8_HTML_PARSER = lxml_html.HTMLParser(encoding="utf-8")
 
 HEADERS = {
     "User-Agent": (
@@ -19,6 +43,11 @@ HEADERS = {
     ),
 }
 
+# One keep-alive pool for habr.com so repeated fetches skip the TCP/TLS handshake.
+SESSION = requests.Session()
+SESSION.headers.update(HEADERS)
+SESSION.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=16))
+
 
 @dataclass
 class FeedItem:
@@ -40,10 +69,18 @@ class Article:
     fetched_at: str
 
 
-def fetch_html(url: str) -> str:
-    resp = requests.get(url, headers=HEADERS, timeout=30)
+def fetch_html(url: str) -> bytes:
+    resp = SESSION.get(url, timeout=30)
     resp.raise_for_status()
-    return resp.text
+    # Raw bytes skip requests' charset decoding; Habr serves UTF-8, which lexbor assumes and lxml is set up for.
+    return resp.content
+
+
+async def _fetch_one(session: aiohttp.ClientSession, semaphore: asyncio.Semaphore, url: str) -> bytes:
+    async with semaphore:
+        async with session.get(url) as resp:
+            resp.raise_for_status()
+            return await resp.read()
 
 
 def normalize_url(href: str) -> str:
@@ -53,66 +90,133 @@ def normalize_url(href: str) -> str:
     return href
 
 
-def parse_feed(feed_html: str) -> List[FeedItem]:
-    soup = BeautifulSoup(feed_html, "lxml")
+def parse_feed(feed_html: bytes) -> List[FeedItem]:
+    tree = LexborHTMLParser(feed_html)
     items: List[FeedItem] = []
 
-    for article in soup.select("article.tm-articles-list__item"):
-        title_tag = article.select_one("h2")
-        link_tag = article.select_one("h2 a[href]")
+    for article in tree.css("article.tm-articles-list__item"):
+        title_tag = article.css_first("h2")
+        link_tag = article.css_first("h2 a[href]")
         if not title_tag or not link_tag:
             continue
-        title = title_tag.get_text(strip=True)
-        url = normalize_url(link_tag.get("href", ""))
-        author_tag = article.select_one("a.tm-user-info__username")
-        time_tag = article.select_one("time[datetime]")
+        title = title_tag.text(strip=True)
+        url = normalize_url(link_tag.attributes.get("href") or "")
+        author_tag = article.css_first("a.tm-user-info__username")
+        time_tag = article.css_first("time[datetime]")
         items.append(
             FeedItem(
                 title=title,
                 url=url,
-                author=author_tag.get_text(strip=True) if author_tag else None,
-                published_at=time_tag.get("datetime") if time_tag else None,
+                author=author_tag.text(strip=True) if author_tag else None,
+                published_at=time_tag.attributes.get("datetime") if time_tag else None,
             )
         )
     return items
 
 
-def extract_content(soup: BeautifulSoup) -> tuple[str, str]:
-    body = soup.select_one("#post-content-body")
-    if not body:
-        body = soup.select_one("div.article-body")
-    if not body:
-        body = soup.select_one("article.tm-article-presenter__content")
-    if not body:
+def node_text_lines(node: LexborNode) -> str:
+    # node.text(strip=True) keeps separators for whitespace-only text nodes and includes script/style
+    # source; skip both like BS4's get_text.
+    parts = (
+        child.text_content.strip()
+        for child in node.traverse(include_text=True)
+        if child.is_text_node and child.parent is not None and child.parent.tag not in NON_TEXT_TAGS
+    )
+    return "\n".join(part for part in parts if part)
+
+
+def _collect_element_text(element: lxml_html.HtmlElement, parts: List[str]) -> None:
+    # Comments have a callable tag; like script/style, only their tail is document text.
+    if not isinstance(element.tag, str) or element.tag in NON_TEXT_TAGS:
+        return
+    if element.text:
+        parts.append(element.text)
+    for child in element:
+        _collect_element_text(child, parts)
+        if child.tail:
+            parts.append(child.tail)
+
+
+def element_text_lines(element: lxml_html.HtmlElement) -> str:
+    parts: List[str] = []
+    _collect_element_text(element, parts)
+    return "\n".join(part.strip() for part in parts if part.strip())
+
+
+def body_priority(tag: str, element_id: Optional[str], class_attr: Optional[str]) -> int:
+    if element_id == "post-content-body":
+        return 0
+    if tag == "div" and "article-body" in (class_attr or "").split():
+        return 1
+    return 2
+
+
+def extract_content(tree: LexborHTMLParser, with_html: bool = True) -> Optional[tuple[str, str]]:
+    """Return (html, text) of the article body, or None when no body candidate matched."""
+    body = min(
+        tree.css(BODY_SELECTOR),
+        key=lambda node: body_priority(node.tag, node.attributes.get("id"), node.attributes.get("class")),
+        default=None,
+    )
+    if body is None:
+        return None
+
+    content_html = (body.html or "") if with_html else ""
+    content_text = node_text_lines(body)
+    return content_html, content_text
+
+
+def extract_content_fallback(html: bytes, with_html: bool = True) -> tuple[str, str]:
+    """Retry body extraction with lxml, whose libxml2 parser recovers broken markup differently."""
+    doc = lxml_html.fromstring(html, parser=_UTF8_HTML_PARSER)
+    body = min(
+        _BODY_XPATH(doc),
+        key=lambda element: body_priority(element.tag, element.get("id"), element.get("class")),
+        default=None,
+    )
+    if body is None:
         return "", ""
 
-    content_html = str(body)
-    content_text = body.get_text("\n", strip=True)
+    content_html = etree.tostring(body, encoding="unicode", method="html", with_tail=False) if with_html else ""
+    content_text = element_text_lines(body)
     return content_html, content_text
 
 
-def extract_tags(soup: BeautifulSoup) -> List[str]:
-    tags = [t.get_text(strip=True) for t in soup.select("div.tm-separated-list.tag-list a.link span")]
-    if not tags:
-        tags = [t.get_text(strip=True) for t in soup.select("a.tm-tags-list__link span")]
-    return [t for t in tags if t]
+def extract_tags(tree: LexborHTMLParser) -> List[str]:
+    # Both tag layouts come back from one query; the tag-list layout still wins when a page has both.
+    # Lexbor returns a node once per selector it matches, so repeats are dropped by identity.
+    tags: List[str] = []
+    legacy_tags: List[str] = []
+    seen = set()
+    for span in tree.css(TAGS_SELECTOR):
+        if span.mem_id in seen:
+            continue
+        seen.add(span.mem_id)
+        (tags if span.css_matches(TAG_LIST_SELECTOR) else legacy_tags).append(span.text(strip=True))
+    return [t for t in tags or legacy_tags if t]
 
 
 def parse_article(url: str) -> Article:
-    html = fetch_html(url)
-    soup = BeautifulSoup(html, "lxml")
+    return parse_article_from_html(url, fetch_html(url))
+
+
+def parse_article_from_html(url: str, html: bytes, store_html: bool = True) -> Article:
+    tree = LexborHTMLParser(html)
 
-    title_tag = soup.select_one("h1.tm-title") or soup.select_one("h1")
-    author_tag = soup.select_one("a.tm-user-info__username")
-    time_tag = soup.select_one("time[datetime]")
-    content_html, content_text = extract_content(soup)
-    tags = extract_tags(soup)
+    title_tag = tree.css_first("h1.tm-title") or tree.css_first("h1")
+    author_tag = tree.css_first("a.tm-user-info__username")
+    time_tag = tree.css_first("time[datetime]")
+    content = extract_content(tree, store_html)
+    if content is None:
+        content = extract_content_fallback(html, store_html)
+    content_html, content_text = content
+    tags = extract_tags(tree)
 
     return Article(
-        title=title_tag.get_text(strip=True) if title_tag else "",
+        title=title_tag.text(strip=True) if title_tag else "",
         url=url,
-        author=author_tag.get_text(strip=True) if author_tag else None,
-        published_at=time_tag.get("datetime") if time_tag else None,
+        author=author_tag.text(strip=True) if author_tag else None,
+        published_at=time_tag.attributes.get("datetime") if time_tag else None,
         content_html=content_html,
         content_text=content_text,
         tags=tags,
@@ -120,7 +224,78 @@ def parse_article(url: str) -> Article:
     )
 
 
-def init_db(conn: sqlite3.Connection) -> None:
+def merge_feed_item(article: Article, item: FeedItem) -> Article:
+    if not article.title:
+        article.title = item.title
+    if not article.author:
+        article.author = item.author
+    if not article.published_at:
+        article.published_at = item.published_at
+    return article
+
+
+async def _async_pipeline(
+    feed_url: str,
+    limit: int,
+    load_cached: Optional[Callable[[List[str]], Dict[str, Article]]] = None,
+    store_html: bool = True,
+) -> Tuple[List[Article], Set[str]]:
+    """Fetch the feed and its articles over one keep-alive session, parsing each page as it arrives."""
+    connector = aiohttp.TCPConnector(limit_per_host=FETCH_CONCURRENCY, keepalive_timeout=30)
+    timeout = aiohttp.ClientTimeout(total=30)
+    semaphore = asyncio.Semaphore(FETCH_CONCURRENCY)
+
+    async with aiohttp.ClientSession(connector=connector, headers=HEADERS, timeout=timeout) as session:
+        items = parse_feed(await _fetch_one(session, semaphore, feed_url))
+        if limit:
+            items = items[:limit]
+        cached = load_cached([item.url for item in items]) if load_cached else {}
+        pending = [item for item in items if item.url not in cached]
+
+        # Parsing a page takes well under a millisecond, so it runs inline as each download lands;
+        # handing it to a worker pool costs more in pickling and process start-up than it saves.
+        async def fetch_and_parse(item: FeedItem) -> Article:
+            html = await _fetch_one(session, semaphore, item.url)
+            return parse_article_from_html(item.url, html, store_html)
+
+        results = await asyncio.gather(*(fetch_and_parse(item) for item in pending), return_exceptions=True)
+
+    fetched = {item.url: result for item, result in zip(pending, results)}
+    articles: List[Article] = []
+    for item in items:
+        if item.url in cached:
+            articles.append(cached[item.url])
+            continue
+        result = fetched[item.url]
+        if isinstance(result, BaseException):
+            print(f"Failed to parse {item.url}: {result}")
+            continue
+        articles.append(merge_feed_item(result, item))
+    return articles, set(cached)
+
+
+def collect_articles(
+    limit: int,
+    feed_url: str = FEED_URL,
+    load_cached: Optional[Callable[[List[str]], Dict[str, Article]]] = None,
+    store_html: bool = True,
+) -> Tuple[List[Article], Set[str]]:
+    """Return feed articles in feed order plus the urls served by load_cached instead of fetched."""
+    return asyncio.run(_async_pipeline(feed_url, limit, load_cached, store_html))
+
+
+def configure_connection(conn: sqlite3.Connection, fast: bool = False) -> None:
+    # WAL is persisted in the DB file, so only switch it once; the rest are per-connection.
+    journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+    if journal_mode.lower() != "wal":
+        conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA synchronous={'OFF' if fast else 'NORMAL'}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-65536")
+
+
+def init_db(conn: sqlite3.Connection, fast: bool = False) -> None:
+    configure_connection(conn, fast)
     conn.execute(
         """
         CREATE TABLE IF NOT EXISTS articles (
@@ -165,70 +340,112 @@ def ensure_zen_columns(conn: sqlite3.Connection) -> None:
         conn.execute("ALTER TABLE zen_posts ADD COLUMN telegram_sent_at TEXT")
 
 
-def save_articles(conn: sqlite3.Connection, articles: Iterable[Article]) -> int:
-    rows = 0
-    for article in articles:
-        tags_json = json.dumps(article.tags, ensure_ascii=True)
-        cursor = conn.execute(
-            """
-            INSERT OR IGNORE INTO articles (
-                url, title, author, published_at, content_html, content_text, tags_json, fetched_at
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (
-                article.url,
-                article.title,
-                article.author,
-                article.published_at,
-                article.content_html,
-                article.content_text,
-                tags_json,
-                article.fetched_at,
-            ),
+def save_articles(conn: sqlite3.Connection, articles: Iterable[Article], max_text_chars: int = 0) -> int:
+    rows = [
+        (
+            article.url,
+            article.title,
+            article.author,
+            article.published_at,
+            article.content_html,
+            article.content_text[:max_text_chars] if max_text_chars > 0 else article.content_text,
+            orjson.dumps(article.tags).decode(),
+            article.fetched_at,
         )
-        rows += cursor.rowcount
-    conn.commit()
-    return rows
+        for article in articles
+    ]
+    before = conn.total_changes
+    with conn:
+        # One multi-row INSERT per chunk runs a single VDBE program instead of one per row.
+        for start in range(0, len(rows), INSERT_CHUNK_ROWS):
+            chunk = rows[start : start + INSERT_CHUNK_ROWS]
+            placeholders = ", ".join(["(?, ?, ?, ?, ?, ?, ?, ?)"] * len(chunk))
+            conn.execute(
+                f"""
+                INSERT OR IGNORE INTO articles (
+                    url, title, author, published_at, content_html, content_text, tags_json, fetched_at
+                ) VALUES {placeholders}
+                """,
+                [value for row in chunk for value in row],
+            )
+    return conn.total_changes - before
+
+
+def load_articles(conn: sqlite3.Connection, urls: List[str]) -> Dict[str, Article]:
+    if not urls:
+        return {}
+    placeholders = ", ".join("?" for _ in urls)
+    cursor = conn.execute(
+        f"""
+        SELECT url, title, author, published_at, content_html, content_text, tags_json, fetched_at
+        FROM articles
+        WHERE url IN ({placeholders})
+        """,
+        urls,
+    )
+    return {
+        row[0]: Article(
+            title=row[1],
+            url=row[0],
+            author=row[2],
+            published_at=row[3],
+            content_html=row[4] or "",
+            content_text=row[5] or "",
+            tags=orjson.loads(row[6]) if row[6] else [],
+            fetched_at=row[7],
+        )
+        for row in cursor
+    }
+
+
+def non_negative_int(value: str) -> int:
+    number = int(value)
+    if number < 0:
+        raise argparse.ArgumentTypeError(f"must be >= 0, got {number}")
+    return number
+
+
+def add_storage_args(parser: argparse.ArgumentParser) -> None:
+    """Register the fetch/storage flags shared by habr_parser and zen_pipeline."""
+    parser.add_argument(
+        "--fast",
+        action="store_true",
+        help="Disable SQLite fsync (synchronous=OFF); an OS crash may lose the last writes",
+    )
+    parser.add_argument("--force", action="store_true", help="Re-fetch articles that are already in the DB")
+    parser.add_argument("--store-html", action="store_true", help="Also store the article body HTML in the DB")
+    parser.add_argument(
+        "--max-text-chars",
+        type=non_negative_int,
+        default=1500,
+        help="Truncate stored article text to this many characters (0 keeps full text)",
+    )
 
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Parse Habr feed and store articles in SQLite")
     parser.add_argument("--db", default="habr.db", help="SQLite DB path")
     parser.add_argument("--limit", type=int, default=10, help="Limit number of feed items to parse")
+    add_storage_args(parser)
     return parser.parse_args()
 
 
 def main() -> int:
     args = parse_args()
-    feed_html = fetch_html(FEED_URL)
-    items = parse_feed(feed_html)
-    if args.limit:
-        items = items[: args.limit]
-
-    articles: List[Article] = []
-    for item in items:
-        try:
-            article = parse_article(item.url)
-        except Exception as exc:
-            print(f"Failed to parse {item.url}: {exc}")
-            continue
-        if not article.title:
-            article.title = item.title
-        if not article.author:
-            article.author = item.author
-        if not article.published_at:
-            article.published_at = item.published_at
-        articles.append(article)
 
     db_path = Path(args.db)
     conn = sqlite3.connect(db_path)
     try:
-        init_db(conn)
-        inserted = save_articles(conn, articles)
+        init_db(conn, fast=args.fast)
+        load_cached = None if args.force else partial(load_articles, conn)
+        articles, cached = collect_articles(args.limit, load_cached=load_cached, store_html=args.store_html)
+        # Stored articles are already in the DB; only the freshly fetched ones need saving.
+        fetched = [a for a in articles if a.url not in cached]
+        inserted = save_articles(conn, fetched, args.max_text_chars)
     finally:
         conn.close()
 
-    print(f"Parsed: {len(articles)}, inserted: {inserted}, db: {db_path}")
+    print(f"Fetched: {len(fetched)}, cached: {len(cached)}, inserted: {inserted}, db: {db_path}")
     return 0
 
 
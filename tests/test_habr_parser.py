@@ -0,0 +1,38 @@
+from selectolax.lexbor import LexborHTMLParser
+
+import habr_parser
+from habr_parser import extract_content, extract_content_fallback, extract_tags, parse_article_from_html
+
+
+def test_extract_tags_span_matching_both_layouts_counted_once():
+    tree = LexborHTMLParser(
+        '<div class="tm-separated-list tag-list"><a class="link tm-tags-list__link"><span>x</span></a></div>'
+        '<a class="tm-tags-list__link"><span>y</span></a>'
+        '<a class="link tm-tags-list__link"><span>z</span></a>'
+    )
+    assert extract_tags(tree) == ["x"]
+
+
+def test_extract_tags_falls_back_to_legacy_layout():
+    tree = LexborHTMLParser(
+        '<a class="tm-tags-list__link"><span>y</span></a><a class="link tm-tags-list__link"><span>z</span></a>'
+    )
+    assert extract_tags(tree) == ["y", "z"]
+
+
+def test_content_text_skips_script_and_style_in_both_parsers():
+    html = (
+        '<div id="post-content-body"><p>a</p><script>var x=1</script>tail'
+        "<style>p{}</style><!-- c -->after</div>"
+    ).encode()
+    assert extract_content(LexborHTMLParser(html), with_html=False) == ("", "a\ntail\nafter")
+    assert extract_content_fallback(html, with_html=False) == ("", "a\ntail\nafter")
+
+
+def test_empty_body_does_not_trigger_lxml_fallback(monkeypatch):
+    def fail(*args):
+        raise AssertionError("fallback should only run when no body matched")
+
+    monkeypatch.setattr(habr_parser, "extract_content_fallback", fail)
+    article = parse_article_from_html("u", b'<div id="post-content-body"><img src="a.png"></div>', store_html=False)
+    assert (article.content_html, article.content_text) == ("", "")
@@ -1,10 +1,11 @@
 ﻿import os
 import sys
-import time
 from pathlib import Path
+from typing import List, Tuple
 
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from selectolax.lexbor import LexborHTMLParser
 
 FEED_URL = "https://habr.com/ru/feed/"
 ARTIFACTS_DIR = Path("artifacts")
@@ -18,58 +19,88 @@ HEADERS = {
     ),
 }
 
+SESSION = requests.Session()
+SESSION.headers.update(HEADERS)
+SESSION.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=16))
 
-def save_text(path: Path, text: str) -> None:
-    path.write_text(text, encoding="utf-8")
 
+def save_html(path: Path, html: bytes) -> None:
+    path.write_bytes(html)
 
-def fetch_html(url: str) -> str:
-    resp = requests.get(url, headers=HEADERS, timeout=30)
+
+def fetch_html(url: str) -> bytes:
+    resp = SESSION.get(url, timeout=30)
     resp.raise_for_status()
-    return resp.text
+    return resp.content
 
 
-def find_first_article_url(feed_html: str) -> str:
-    soup = BeautifulSoup(feed_html, "lxml")
+def find_first_article_url(feed_html: bytes) -> str:
+    tree = LexborHTMLParser(feed_html)
     # Habr feed items contain a title link inside article.
-    link = soup.select_one("article h2 a[href]")
+    link = tree.css_first("article h2 a[href]")
     if not link:
         raise RuntimeError("Could not find article link in feed HTML")
-    href = link.get("href", "").strip()
+    href = (link.attributes.get("href") or "").strip()
     if href.startswith("/"):
         href = "https://habr.com" + href
     return href
 
 
-def try_screenshot(url: str, out_path: Path) -> None:
+# Step through the page one viewport at a time so lazy-loaded images get requested.
+SCROLL_THROUGH_JS = """
+async () => {
+    for (let y = 0; y < document.body.scrollHeight; y += window.innerHeight) {
+        window.scrollTo(0, y);
+        await new Promise((resolve) => setTimeout(resolve, 100));
+    }
+    window.scrollTo(0, 0);
+}
+"""
+IMAGES_LOADED_JS = "() => Array.from(document.images).every((img) => img.complete)"
+
+
+def try_screenshots(targets: List[Tuple[str, Path]]) -> None:
     try:
-        from playwright.sync_api import sync_playwright
+        from playwright.sync_api import TimeoutError as PlaywrightTimeoutError, sync_playwright
     except Exception as exc:  # pragma: no cover - best effort
-        print(f"Playwright not available, skipping screenshot for {url}: {exc}")
+        print(f"Playwright not available, skipping screenshots: {exc}")
         return
 
     with sync_playwright() as p:
         browser = p.chromium.launch()
-        page = browser.new_page()
-        page.goto(url, wait_until="networkidle", timeout=60000)
-        time.sleep(2)
-        page.screenshot(path=str(out_path), full_page=True)
-        browser.close()
+        try:
+            for url, out_path in targets:
+                page = browser.new_page()
+                try:
+                    page.goto(url, wait_until="networkidle", timeout=60000)
+                    page.evaluate(SCROLL_THROUGH_JS)
+                    try:
+                        page.wait_for_function(IMAGES_LOADED_JS, timeout=10000)
+                    except PlaywrightTimeoutError:
+                        print(f"Images still loading on {url}, taking screenshot anyway")
+                    page.screenshot(path=str(out_path), full_page=True)
+                finally:
+                    page.close()
+        finally:
+            browser.close()
 
 
 def main() -> int:
     feed_html = fetch_html(FEED_URL)
     feed_path = ARTIFACTS_DIR / "feed.html"
-    save_text(feed_path, feed_html)
-
-    try_screenshot(FEED_URL, ARTIFACTS_DIR / "feed.png")
+    save_html(feed_path, feed_html)
 
     detail_url = find_first_article_url(feed_html)
     detail_html = fetch_html(detail_url)
     detail_path = ARTIFACTS_DIR / "detail.html"
-    save_text(detail_path, detail_html)
-
-    try_screenshot(detail_url, ARTIFACTS_DIR / "detail.png")
+    save_html(detail_path, detail_html)
+
+    try_screenshots(
+        [
+            (FEED_URL, ARTIFACTS_DIR / "feed.png"),
+            (detail_url, ARTIFACTS_DIR / "detail.png"),
+        ]
+    )
 
     print(f"Saved feed html: {feed_path}")
     print(f"Saved detail html: {detail_path}")
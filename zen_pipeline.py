@@ -1,25 +1,64 @@
 ﻿import argparse
-import json
 import sqlite3
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from datetime import datetime, timezone
+from functools import partial
 from pathlib import Path
 from typing import List, Optional
 
+import orjson
 import requests
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
 
 from habr_parser import (
-    FEED_URL,
-    fetch_html,
+    add_storage_args,
+    collect_articles,
     init_db,
-    parse_article,
-    parse_feed,
+    load_articles,
     save_articles,
 )
 
 
+API_POOL_SIZE = 8
+
+
+def _api_session(retries: Retry) -> requests.Session:
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_maxsize=API_POOL_SIZE, max_retries=retries))
+    return session
+
+
+# Separate keep-alive pools per upstream so connections stay warm across the per-article loop.
+# urllib3 never retries POST unless asked. Completions are safe to repeat, so OpenAI also
+# retries gateway errors and read timeouts.
+_OPENAI_SESSION = _api_session(
+    Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=frozenset({"POST"}),
+        raise_on_status=False,
+    )
+)
+# sendMessage is not idempotent: only retry when the message cannot have been accepted,
+# i.e. connection failures and 429 rate limits, never read timeouts or 5xx.
+_TELEGRAM_SESSION = _api_session(
+    Retry(
+        total=3,
+        read=0,
+        other=0,
+        backoff_factor=0.5,
+        status_forcelist=[429],
+        allowed_methods=frozenset({"POST"}),
+        raise_on_status=False,
+    )
+)
+
+
 @dataclass
 class RankedArticle:
     url: str
@@ -51,7 +90,7 @@ def build_rank_prompt(articles: List[dict], top_k: int) -> str:
         "Return JSON only: {\"items\": [{\"url\": \"...\", \"title\": \"...\", \"reason\": \"...\"}]} "
         f"Choose exactly {top_k} items. Use the input list, keep urls exact.\n\n"
         "Articles:\n"
-        + json.dumps(articles, ensure_ascii=False, indent=2)
+        + orjson.dumps(articles).decode()
     )
 
 
@@ -60,7 +99,7 @@ def build_zen_prompt(article: dict) -> str:
         "Write a Yandex Zen post in Russian based on the article data. "
         "Keep it engaging for a broad audience and avoid clickbait. "
         "Return JSON only: {\"title\": \"...\", \"lead\": \"...\", \"body\": \"...\"}.\n\n"
-        + json.dumps(article, ensure_ascii=False, indent=2)
+        + orjson.dumps(article).decode()
     )
 
 
@@ -78,7 +117,7 @@ def call_openai(api_key: str, model: str, prompt: str) -> str:
         ],
         "temperature": 0.6,
     }
-    resp = requests.post(url, headers=headers, json=payload, timeout=60)
+    resp = _OPENAI_SESSION.post(url, headers=headers, json=payload, timeout=60)
     resp.raise_for_status()
     data = resp.json()
     return data["choices"][0]["message"]["content"]
@@ -100,7 +139,7 @@ def compose_telegram_message(title: str, lead: str, body: str, url: str) -> str:
 def send_telegram_message(token: str, chat_id: str, text: str) -> str:
     url = f"https://api.telegram.org/bot{token}/sendMessage"
     payload = {"chat_id": chat_id, "text": text}
-    resp = requests.post(url, data=payload, timeout=30)
+    resp = _TELEGRAM_SESSION.post(url, data=payload, timeout=30)
     resp.raise_for_status()
     data = resp.json()
     return str(data["result"]["message_id"])
@@ -112,7 +151,7 @@ def parse_json_from_response(text: str) -> dict:
         lines = text.splitlines()
         if len(lines) >= 3:
             text = "\n".join(lines[1:-1]).strip()
-    return json.loads(text)
+    return orjson.loads(text)
 
 
 def rank_articles(api_key: str, model: str, articles: List[dict], top_k: int) -> List[RankedArticle]:
@@ -150,6 +189,7 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument("--db", default="habr.db", help="SQLite DB path")
     parser.add_argument("--limit", type=int, default=10, help="Number of feed items to parse")
     parser.add_argument("--top-k", type=int, default=3, help="Number of Zen posts to generate")
+    add_storage_args(parser)
     return parser.parse_args()
 
 
@@ -159,31 +199,13 @@ def main() -> int:
     api_key, model = get_openai_config()
     tg_token, tg_chat_id = get_telegram_config()
 
-    feed_html = fetch_html(FEED_URL)
-    items = parse_feed(feed_html)
-    if args.limit:
-        items = items[: args.limit]
-
-    articles = []
-    for item in items:
-        try:
-            article = parse_article(item.url)
-        except Exception as exc:
-            print(f"Failed to parse {item.url}: {exc}")
-            continue
-        if not article.title:
-            article.title = item.title
-        if not article.author:
-            article.author = item.author
-        if not article.published_at:
-            article.published_at = item.published_at
-        articles.append(article)
-
     db_path = Path(args.db)
     conn = sqlite3.connect(db_path)
     try:
-        init_db(conn)
-        save_articles(conn, articles)
+        init_db(conn, fast=args.fast)
+        load_cached = None if args.force else partial(load_articles, conn)
+        articles, cached = collect_articles(args.limit, load_cached=load_cached, store_html=args.store_html)
+        save_articles(conn, [a for a in articles if a.url not in cached], args.max_text_chars)
 
         briefs = [
             {
@@ -199,6 +221,7 @@ def main() -> int:
 
         ranked = rank_articles(api_key, model, briefs, args.top_k)
         article_map = {a.url: a for a in articles}
+        selected = []
         for item in ranked:
             if not item.url:
                 continue
@@ -213,7 +236,18 @@ def main() -> int:
                 "tags": source_article.tags,
                 "summary": source_article.content_text[:1200],
             }
-            zen_payload = generate_zen_post(api_key, model, article_brief)
+            selected.append((item, source_article, article_brief))
+
+        # Only the OpenAI calls run in threads; DB writes and Telegram sends stay on this thread.
+        with ThreadPoolExecutor(max_workers=max(min(len(selected), API_POOL_SIZE), 1)) as executor:
+            futures = [executor.submit(generate_zen_post, api_key, model, entry[2]) for entry in selected]
+
+        for (item, source_article, article_brief), future in zip(selected, futures):
+            try:
+                zen_payload = future.result()
+            except Exception as exc:
+                print(f"Zen generation failed for {article_brief['url']}: {exc}")
+                continue
             zen_title = zen_payload.get("title", "").strip() or source_article.title
             zen_lead = zen_payload.get("lead", "").strip()
             zen_body = zen_payload.get("body", "").strip()
@@ -221,45 +255,42 @@ def main() -> int:
             if not zen_body:
                 continue
 
-            cursor = conn.execute(
-                """
-                INSERT OR IGNORE INTO zen_posts (
-                    article_url, zen_title, zen_lead, zen_body, selection_reason, model, created_at
-                ) VALUES (?, ?, ?, ?, ?, ?, ?)
-                """,
-                (
-                    article_brief["url"],
-                    zen_title,
-                    zen_lead,
-                    zen_body,
-                    item.reason,
-                    model,
-                    datetime.now(timezone.utc).isoformat(),
-                ),
-            )
-            if tg_token and tg_chat_id:
-                should_send = cursor.rowcount > 0
-                if not should_send:
-                    row = conn.execute(
-                        "SELECT telegram_message_id FROM zen_posts WHERE article_url = ?",
-                        (article_brief["url"],),
-                    ).fetchone()
-                    should_send = row is not None and row[0] is None
-                if should_send:
-                    try:
-                        message = compose_telegram_message(zen_title, zen_lead, zen_body, article_brief["url"])
-                        message_id = send_telegram_message(tg_token, tg_chat_id, message)
+            # New posts and stored-but-unsent posts come back as a row; already sent ones return nothing.
+            with conn:
+                pending = conn.execute(
+                    """
+                    INSERT INTO zen_posts (
+                        article_url, zen_title, zen_lead, zen_body, selection_reason, model, created_at
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(article_url) DO UPDATE SET telegram_message_id = NULL
+                    WHERE zen_posts.telegram_message_id IS NULL
+                    RETURNING id
+                    """,
+                    (
+                        article_brief["url"],
+                        zen_title,
+                        zen_lead,
+                        zen_body,
+                        item.reason,
+                        model,
+                        datetime.now(timezone.utc).isoformat(),
+                    ),
+                ).fetchall()
+            if tg_token and tg_chat_id and pending:
+                try:
+                    message = compose_telegram_message(zen_title, zen_lead, zen_body, article_brief["url"])
+                    message_id = send_telegram_message(tg_token, tg_chat_id, message)
+                    with conn:
                         conn.execute(
                             """
                             UPDATE zen_posts
                             SET telegram_message_id = ?, telegram_sent_at = ?
-                            WHERE article_url = ?
+                            WHERE article_url = ? AND telegram_message_id IS NULL
                             """,
                             (message_id, datetime.now(timezone.utc).isoformat(), article_brief["url"]),
                         )
-                    except Exception as exc:
-                        print(f"Telegram send failed for {article_brief['url']}: {exc}")
-        conn.commit()
+                except Exception as exc:
+                    print(f"Telegram send failed for {article_brief['url']}: {exc}")
     finally:
         conn.close()
 